@@ -1,6 +1,8 @@
 from otree.api import *
+from array import array
 import json
 import random
+import time
 
 doc = """
 Market experiment with 6 players per group: 1 producer, 2 sellers, and 3 buyers.
@@ -27,11 +29,16 @@ class Subsession(BaseSubsession):
 class Group(BaseGroup):
     public_ledger = models.LongStringField(initial="[]")  # Store ledger as JSON
     buyer_order = models.LongStringField(initial="[]")
+    stall_stats = models.LongStringField(initial="{}")  # Timeouts per phase as JSON
+    market_snapshot = models.LongStringField(blank=True)  # Unflushed live market state
+    monitor = models.LongStringField(initial="{}")  # Live phase/wait/throughput metrics as JSON
+    checkpoint = models.LongStringField(blank=True)  # Holdings and ledger size at the last phase boundary
 
     def add_to_ledger(self, transaction):
         ledger = json.loads(self.public_ledger)
         ledger.append(transaction)
         self.public_ledger = json.dumps(ledger)
+        note_transactions(self, 1)
 
 
 class Player(BasePlayer):
@@ -73,6 +80,7 @@ class Player(BasePlayer):
 
 
 def calculate_payoff(group):
+    flush_market(group)
 
     for player in group.get_players():
 
@@ -104,11 +112,428 @@ def calculate_payoff(group):
 
                 player.payoff = (buy_amount_a1 + buy_amount_a1) * 5 + player.tokens
 
+# Timeouts
+
+# Default decision applied when a page times out, keyed by phase.
+# Override per session with '<phase>_timeout_decision' in the session config.
+TIMEOUT_DECISION_DEFAULTS = {
+    'offer': 'no_offer',
+    'decision': 'reject',
+    'pricing': 'keep_last_price',
+    'guess': 'midpoint_guess',
+    'buying': 'no_purchase',
+}
+
+TIMEOUT_DECISIONS = {}
+
+
+def timeout_decision(name):
+    def register(func):
+        TIMEOUT_DECISIONS[name] = func
+        return func
+    return register
+
+
+@timeout_decision('no_offer')
+def no_offer(player: Player):
+    player.offer_to_producer = None
+
+
+@timeout_decision('reject')
+def reject(player: Player):
+    player.accept_offer_2 = False
+    player.accept_offer_3 = False
+
+
+@timeout_decision('keep_last_price')
+def keep_last_price(player: Player):
+    last_price = None
+    if player.round_number > 1:
+        last_price = player.in_round(player.round_number - 1).field_maybe_none('product_price')
+    player.product_price = last_price if last_price is not None else Constants.product_price_suggestion
+
+
+@timeout_decision('midpoint_guess')
+def midpoint_guess(player: Player):
+    player.guess = 50
+
+
+@timeout_decision('no_guess')
+def no_guess(player: Player):
+    player.guess = None  # rank_buyers puts blank guesses last
+
+
+@timeout_decision('no_purchase')
+def no_purchase(player: Player):
+    for buyer_rank in [1, 2, 3]:
+        for seller_index in [1, 2]:
+            setattr(player, f'b{buyer_rank}_buy_decision_a{seller_index}', False)
+            setattr(player, f'b{buyer_rank}_buy_amount_a{seller_index}', None)
+
+
+def phase_timeout(player: Player, phase):
+    # 0 (the default) means the page never times out
+    return player.session.config.get(f'{phase}_timeout_seconds', 0) or None
+
+
+def timeout_decision_name(config, phase):
+    return config.get(f'{phase}_timeout_decision', TIMEOUT_DECISION_DEFAULTS[phase])
+
+
+def check_timeout_decisions(config):
+    # Fail at session creation rather than inside a timed-out page submit
+    for phase in TIMEOUT_DECISION_DEFAULTS:
+        name = timeout_decision_name(config, phase)
+        if name not in TIMEOUT_DECISIONS:
+            raise ValueError(
+                f"Unknown {phase}_timeout_decision '{name}'. Choose one of: {', '.join(TIMEOUT_DECISIONS)}"
+            )
+
+
+def apply_timeout_decision(player: Player, phase):
+    TIMEOUT_DECISIONS[timeout_decision_name(player.session.config, phase)](player)
+    record_timeout(player, phase)
+
+
+def record_timeout(player: Player, phase):
+    stats = json.loads(player.group.stall_stats)
+    phase_stats = stats.setdefault(phase, {'timeouts': 0, 'players': []})
+    phase_stats['timeouts'] += 1
+    phase_stats['players'].append(player.id_in_group)
+    player.group.stall_stats = json.dumps(stats)
+
+
+# Live market
+
+class MarketState:
+    """
+    Compact in-memory state of one group's market during the buying phase.
+
+    Arrays are indexed by id_in_group - 1. Purchases only touch this object
+    and a JSON snapshot on the group; the Player rows and the public ledger
+    are written once, when the phase ends (flush_market).
+    """
+    __slots__ = ('positions', 'tokens', 'products', 'prices', 'ledger_tail')
+
+    NO_PRICE = -1
+
+    @classmethod
+    def create(cls, positions, tokens, products, prices, ledger_tail=()):
+        state = cls()
+        state.positions = tuple(positions)
+        state.tokens = array('i', tokens)
+        state.products = array('i', products)
+        state.prices = array('i', prices)
+        state.ledger_tail = list(ledger_tail)  # Transactions not yet in public_ledger
+        return state
+
+    @classmethod
+    def from_players(cls, players):
+        return cls.create(
+            positions=[p.position for p in players],
+            tokens=[p.tokens for p in players],
+            products=[p.field_maybe_none('products') or 0 for p in players],
+            prices=[
+                cls.NO_PRICE if p.field_maybe_none('product_price') is None else p.product_price
+                for p in players
+            ],
+        )
+
+    @classmethod
+    def from_json(cls, snapshot):
+        return cls.create(**json.loads(snapshot))
+
+    def to_json(self):
+        return json.dumps({
+            'positions': self.positions,
+            'tokens': self.tokens.tolist(),
+            'products': self.products.tolist(),
+            'prices': self.prices.tolist(),
+            'ledger_tail': self.ledger_tail,
+        })
+
+    def sellers_in_stock(self):
+        # Sellers who left their price blank can't be bought from
+        return [
+            i + 1 for i, position in enumerate(self.positions)
+            if position == "seller" and self.products[i] > 0 and self.prices[i] != self.NO_PRICE
+        ]
+
+    def sell(self, buyer_id, seller_id, quantity, round_number):
+        cost = quantity * self.prices[seller_id - 1]
+        self.tokens[buyer_id - 1] -= cost
+        self.tokens[seller_id - 1] += cost
+        self.products[seller_id - 1] -= quantity
+        self.ledger_tail.append({
+            'round': round_number,
+            'type': "Product Sale",
+            'buyer_id': buyer_id,
+            'buyer_role': "Buyer",
+            'seller_id': seller_id,
+            'seller_role': "Seller",
+            'amount': cost,
+            'quantity': quantity,
+            'remaining_stock': self.products[seller_id - 1],
+        })
+
+
+LIVE_MARKETS = {}  # group.id -> MarketState
+
+
+def market_state(group: Group):
+    state = LIVE_MARKETS.get(group.id)
+    if state is None:
+        # After a restart, resume from the snapshot instead of the stale Player rows
+        snapshot = group.field_maybe_none('market_snapshot')
+        if snapshot:
+            state = MarketState.from_json(snapshot)
+        else:
+            state = MarketState.from_players(group.get_players())
+        LIVE_MARKETS[group.id] = state
+    return state
+
+
+def save_market(group: Group):
+    group.market_snapshot = market_state(group).to_json()
+
+
+def market_is_open(group: Group):
+    return group.id in LIVE_MARKETS or bool(group.field_maybe_none('market_snapshot'))
+
+
+def market_ledger(group: Group):
+    return json.loads(group.public_ledger) + market_state(group).ledger_tail
+
+
+def flush_market(group: Group):
+    if not market_is_open(group):
+        return  # No market was opened for this group
+
+    state = market_state(group)
+    for player in group.get_players():
+        player.tokens = state.tokens[player.id_in_group - 1]
+        if player.position == "seller":
+            player.products = state.products[player.id_in_group - 1]
+
+    ledger = json.loads(group.public_ledger)
+    ledger.extend(state.ledger_tail)
+    group.public_ledger = json.dumps(ledger)
+
+    group.market_snapshot = None
+    del LIVE_MARKETS[group.id]
+
+
+# Monitoring
+
+# Phases in page order; each group-wide Wait moves the group to the next one,
+# except during buying, where it hands over to the next buyer in buyer_order
+PHASES = ['introduction', 'offer', 'decision', 'pricing', 'guess', 'buying', 'results']
+
+
+def load_monitor(group: Group):
+    monitor = json.loads(group.monitor)
+    if not monitor:
+        now = time.time()
+        monitor = {
+            'phase': PHASES[0],
+            'buyer_index': 0,
+            'started': now,
+            'phase_started': now,
+            'arrivals': {},  # First arrival time at each Wait, keyed by step
+            'waits': {},  # Seconds from first arrival to release, keyed by step
+            'transactions': 0,
+            'recovered': 0,  # Players whose holdings were repaired by recover_group
+        }
+    return monitor
+
+
+def wait_step(monitor, name=None):
+    # Wait pages that don't end a phase (e.g. RankBuyers) add their own name
+    step = f"{monitor['phase']}-{monitor['buyer_index']}"
+    return f"{step}-{name}" if name else step
+
+
+def note_wait_arrival(group: Group, name=None):
+    monitor = load_monitor(group)
+    monitor['arrivals'].setdefault(wait_step(monitor, name), time.time())
+    group.monitor = json.dumps(monitor)
+
+
+def record_wait(group: Group, name=None):
+    monitor = load_monitor(group)
+    step = wait_step(monitor, name)
+    now = time.time()
+    monitor['waits'][step] = now - monitor['arrivals'].get(step, now)
+    group.monitor = json.dumps(monitor)
+
+
+def end_wait(group: Group):
+    ensure_recovered(group)
+    record_wait(group)
+
+    monitor = load_monitor(group)
+    now = time.time()
+    phase = monitor['phase']
+
+    if phase == 'buying' and monitor['buyer_index'] < 2:
+        monitor['buyer_index'] += 1
+    elif phase != PHASES[-1]:
+        monitor['phase'] = PHASES[PHASES.index(phase) + 1]
+        monitor['phase_started'] = now
+    group.monitor = json.dumps(monitor)
+
+    take_checkpoint(group)
+
+
+def note_transactions(group: Group, count):
+    if count:
+        monitor = load_monitor(group)
+        monitor['transactions'] += count
+        group.monitor = json.dumps(monitor)
+
+
+def vars_for_admin_report(subsession: Subsession):
+    now = time.time()
+    rows = []
+    for group in subsession.get_groups():
+        monitor = load_monitor(group)
+        current_buyer = None
+        if monitor['phase'] == 'buying':
+            current_buyer = json.loads(group.buyer_order)[monitor['buyer_index']]
+        waiting = [arrived for step, arrived in monitor['arrivals'].items() if step not in monitor['waits']]
+        waiting_since = max(waiting) if waiting else None
+        minutes = max(now - monitor['started'], 1) / 60
+
+        rows.append({
+            'id': group.id_in_subsession,
+            'phase': monitor['phase'],
+            'phase_seconds': round(now - monitor['phase_started']),
+            'waiting_seconds': round(now - waiting_since) if waiting_since else None,
+            'waits': {step: round(seconds) for step, seconds in monitor['waits'].items()},
+            'current_buyer': current_buyer,
+            'transactions': monitor['transactions'],
+            'transactions_per_minute': round(monitor['transactions'] / minutes, 2),
+            'recovered': monitor['recovered'],
+            'timeouts': {
+                phase: {'count': stats['timeouts'], 'players': ", ".join(str(p) for p in stats['players'])}
+                for phase, stats in json.loads(group.stall_stats).items()
+            },
+        })
+    return {'groups': rows}
+
+
+# Recovery
+
+RECOVERED_GROUPS = set()  # Groups verified since this process started
+
+
+def group_holdings(group: Group):
+    # [tokens, bases, products] per player, indexed by id_in_group - 1
+    holdings = [
+        [p.tokens, p.field_maybe_none('bases') or 0, p.field_maybe_none('products') or 0]
+        for p in group.get_players()
+    ]
+    if market_is_open(group):
+        state = market_state(group)
+        for i, held in enumerate(holdings):
+            held[0] = state.tokens[i]
+            held[2] = state.products[i]
+    return holdings
+
+
+def group_ledger(group: Group):
+    return market_ledger(group) if market_is_open(group) else json.loads(group.public_ledger)
+
+
+def take_checkpoint(group: Group):
+    group.checkpoint = json.dumps({
+        'holdings': group_holdings(group),
+        'ledger_size': len(group_ledger(group)),
+    })
+
+
+def replay(holdings, transactions):
+    for transaction in transactions:
+        seller = holdings[transaction['seller_id'] - 1]
+        buyer = holdings[transaction['buyer_id'] - 1]
+        amount = transaction['amount']
+
+        if transaction['type'] == "Base Purchase":
+            # The seller pays the producer for one base, which yields 2 products
+            seller[0] -= amount
+            seller[1] += 1
+            seller[2] += 2
+            buyer[0] += amount
+            buyer[1] -= 1
+        elif transaction['type'] == "Product Sale":
+            buyer[0] -= amount
+            seller[0] += amount
+            seller[2] -= transaction['quantity']
+    return holdings
+
+
+def recover_group(group: Group):
+    """
+    Compare holdings with the last checkpoint plus the ledger entries written
+    since, and repair any player that disagrees. The ledger is authoritative:
+    logged transactions are replayed and unlogged changes are rolled back.
+    Only the current round's entries after the checkpoint are examined.
+    """
+    checkpoint = group.field_maybe_none('checkpoint')
+    if not checkpoint:
+        return []
+
+    checkpoint = json.loads(checkpoint)
+    new_transactions = group_ledger(group)[checkpoint['ledger_size']:]
+    expected = replay(checkpoint['holdings'], new_transactions)
+    actual = group_holdings(group)
+
+    repaired = [i + 1 for i in range(len(actual)) if actual[i] != expected[i]]
+    if not repaired:
+        return []
+
+    market = market_state(group) if market_is_open(group) else None
+    for player in group.get_players():
+        if player.id_in_group not in repaired:
+            continue
+        tokens, bases, products = expected[player.id_in_group - 1]
+        if market:
+            market.tokens[player.id_in_group - 1] = tokens
+            market.products[player.id_in_group - 1] = products
+        else:
+            player.tokens = tokens
+            if (player.field_maybe_none('products') or 0) != products:
+                player.products = products
+        if (player.field_maybe_none('bases') or 0) != bases:
+            player.bases = bases
+    if market:
+        save_market(group)
+
+    monitor = load_monitor(group)
+    monitor['recovered'] += len(repaired)
+    group.monitor = json.dumps(monitor)
+    return repaired
+
+
+def ensure_recovered(group: Group):
+    # Verify each group once per process, i.e. on first use after a restart
+    if group.id not in RECOVERED_GROUPS:
+        RECOVERED_GROUPS.add(group.id)
+        recover_group(group)
+
+
 # Functions
 
 def creating_session(subsession: Subsession):
-    subsession.treatment = subsession.session.config.get('treatment', 'default')
-    subsession.random_number = random.randint(1, 100)
+    config = subsession.session.config
+    subsession.treatment = config.get('treatment', 'default')
+    if subsession.round_number == 1:
+        check_timeout_decisions(config)
+
+    # A fixed seed makes pre-created (pooled) sessions reproducible
+    seed = config.get('random_seed')
+    rng = random.Random(f"{seed}-{subsession.round_number}") if seed else random
+    subsession.random_number = rng.randint(1, 100)
 
     for player in subsession.get_players():
         if player.id_in_group == 1:
@@ -125,32 +550,114 @@ def creating_session(subsession: Subsession):
             player.tokens = Constants.buyer_initial_tokens
             player.products = 0  # ✅ Initialize for consistency
 
-        # Dynamically create accept_offer_<seller_id> fields for producers
-        if player.position == "producer":
-            for seller in subsession.get_players():
-                if seller.position == "seller":
-                    setattr(
-                        Player,
-                        f'accept_offer_{seller.id_in_group}',
-                        models.BooleanField(blank=True)
-                    )
-
 
 def rank_buyers(group: Group):
     buyers = [p for p in group.get_players() if p.position == "buyer"]
 
-    # Calculate distance from the random number
+    # Calculate distance from the random number (no guess, e.g. after a timeout, leaves rank blank)
     for buyer in buyers:
-        buyer.rank = abs(buyer.subsession.random_number - buyer.guess)
+        guess = buyer.field_maybe_none('guess')
+        if guess is not None:
+            buyer.rank = abs(buyer.subsession.random_number - guess)
+
+    # Sort buyers by closest guess; buyers without a guess go last
+    def distance(buyer):
+        rank = buyer.field_maybe_none('rank')
+        return rank if rank is not None else float('inf')
 
-    # Sort buyers by closest guess
-    buyers_sorted = sorted(buyers, key=lambda b: b.rank)
+    buyers_sorted = sorted(buyers, key=distance)
     buyer_order = [b.id_in_group for b in buyers_sorted]
 
     # Store the order in JSON format
     group.buyer_order = json.dumps(buyer_order)
 
 
+# Buying
+
+def is_buyer_turn(player: Player, rank):
+    if player.position != "buyer":
+        return False
+
+    # Buyers act in the order of the guessing game result
+    buyer_order = json.loads(player.group.buyer_order)
+    return player.id_in_group == buyer_order[rank - 1]
+
+
+def market_form_fields(player: Player, rank):
+    sellers_in_stock = market_state(player.group).sellers_in_stock()
+
+    # Yes/No decision for each seller, then the amount to buy
+    fields = [f'b{rank}_buy_decision_a{seller_id - 1}' for seller_id in sellers_in_stock]
+    fields += [f'b{rank}_buy_amount_a{seller_id - 1}' for seller_id in sellers_in_stock]
+    return fields
+
+
+def market_vars_for_template(player: Player):
+    market = market_state(player.group)
+    sellers = [
+        {
+            'id': seller_id,
+            'price': market.prices[seller_id - 1],
+            'stock': market.products[seller_id - 1],
+            'adjusted_id': seller_id - 1  # Seller ID - 1
+        }
+        for seller_id in market.sellers_in_stock()
+    ]
+
+    buyer_order = json.loads(player.group.buyer_order)
+    rank_index = buyer_order.index(player.id_in_group) + 1  # Convert 0-based index to 1-based rank
+    return {
+        'sellers': sellers,
+        'tokens': market.tokens[player.id_in_group - 1],
+        'ledger': market_ledger(player.group),
+        'buyer_order': buyer_order,
+        'rank_index': 1,
+        'random_number': player.subsession.random_number,
+        'instructions': f"You are ranked {rank_index}. You will buy when it's your turn.",
+    }
+
+
+def buy_from_market(player: Player, rank, timeout_happened):
+    ensure_recovered(player.group)
+
+    if timeout_happened:
+        apply_timeout_decision(player, 'buying')
+
+    market = market_state(player.group)
+    sales_before = len(market.ledger_tail)
+
+    # Work out every purchase before applying any, so a rejected submit
+    # leaves the in-memory market untouched
+    purchases = []
+    for seller_id in market.sellers_in_stock():
+        decision_field = f'b{rank}_buy_decision_a{seller_id - 1}'
+        quantity_field = f'b{rank}_buy_amount_a{seller_id - 1}'
+
+        # ✅ Use field_maybe_none() to avoid NoneType error
+        buy_decision = player.field_maybe_none(decision_field) or False
+        quantity_requested = player.field_maybe_none(quantity_field) or 0
+
+        if buy_decision:  # Buyer said "Yes"
+            quantity_purchased = min(quantity_requested, market.products[seller_id - 1])
+            if quantity_purchased > 0:
+                purchases.append((seller_id, quantity_purchased))
+
+    # **🚨 Prevent overspending**
+    cost = sum(quantity * market.prices[seller_id - 1] for seller_id, quantity in purchases)
+    buyer_tokens = market.tokens[player.id_in_group - 1]
+    if cost > buyer_tokens:
+        raise ValueError(
+            f"Error: You only have {buyer_tokens} tokens but tried to spend {cost}!"
+        )  # ❌ Buyer tried to overspend
+
+    for seller_id, quantity_purchased in purchases:
+        # ✅ Update tokens and stock, and log the transaction
+        market.sell(player.id_in_group, seller_id, quantity_purchased, player.round_number)
+
+    save_market(player.group)
+    note_transactions(player.group, len(market.ledger_tail) - sales_before)
+
+
 # Pages
 
 class Introduction(Page):
@@ -163,6 +670,15 @@ class Introduction(Page):
             'product_price_suggestion': Constants.product_price_suggestion,
         }
 
+    @staticmethod
+    def get_timeout_seconds(player: Player):
+        return phase_timeout(player, 'introduction')
+
+    @staticmethod
+    def before_next_page(player: Player, timeout_happened):
+        if timeout_happened:
+            record_timeout(player, 'introduction')
+
 
 class OfferToProducer(Page):
     form_model = 'player'
@@ -179,6 +695,15 @@ class OfferToProducer(Page):
             'instructions': "As a seller, make an offer to buy a base from the producer (1-3 Tokens).",
         }
 
+    @staticmethod
+    def get_timeout_seconds(player: Player):
+        return phase_timeout(player, 'offer')
+
+    @staticmethod
+    def before_next_page(player: Player, timeout_happened):
+        if timeout_happened:
+            apply_timeout_decision(player, 'offer')
+
 
 class DecideOnOffer(Page):
     form_model = 'player'
@@ -196,7 +721,7 @@ class DecideOnOffer(Page):
                 'form_field': f'accept_offer_{seller.id_in_group}',
             }
             for seller in player.group.get_players()
-            if seller.position == "seller" and seller.offer_to_producer is not None
+            if seller.position == "seller" and seller.field_maybe_none('offer_to_producer') is not None
         ]
         return {
             'sellers': sellers,
@@ -209,9 +734,18 @@ class DecideOnOffer(Page):
         # Return the predefined form fields for sellers 2 and 3
         return ['accept_offer_2', 'accept_offer_3']
 
+    @staticmethod
+    def get_timeout_seconds(player: Player):
+        return phase_timeout(player, 'decision')
+
     def before_next_page(player: Player, timeout_happened):
+        ensure_recovered(player.group)
+
+        if timeout_happened:
+            apply_timeout_decision(player, 'decision')
+
         for seller in player.group.get_players():
-            if seller.position == "seller" and seller.offer_to_producer is not None:
+            if seller.position == "seller" and seller.field_maybe_none('offer_to_producer') is not None:
                 field_name = f'accept_offer_{seller.id_in_group}'
                 if getattr(player, field_name):  # If the producer accepted the offer
                     seller.tokens -= seller.offer_to_producer
@@ -242,8 +776,25 @@ class GuessNumber(Page):
     def is_displayed(player: Player):
         return player.position == "buyer"
 
+    @staticmethod
+    def get_timeout_seconds(player: Player):
+        return phase_timeout(player, 'guess')
+
+    @staticmethod
+    def before_next_page(player: Player, timeout_happened):
+        if timeout_happened:
+            apply_timeout_decision(player, 'guess')
+
 class RankBuyers(WaitPage):
-    after_all_players_arrive = 'rank_buyers'
+    @staticmethod
+    def vars_for_template(player: Player):
+        note_wait_arrival(player.group, 'ranking')
+        return {}
+
+    @staticmethod
+    def after_all_players_arrive(group: Group):
+        record_wait(group, 'ranking')
+        rank_buyers(group)
 
 
 class SetProductPrice(Page):
@@ -261,6 +812,15 @@ class SetProductPrice(Page):
             'instructions': "Set a price for your products.",
         }
 
+    @staticmethod
+    def get_timeout_seconds(player: Player):
+        return phase_timeout(player, 'pricing')
+
+    @staticmethod
+    def before_next_page(player: Player, timeout_happened):
+        if timeout_happened:
+            apply_timeout_decision(player, 'pricing')
+
 
 class BuyProducts(Page):
     form_model = 'player'
@@ -367,294 +927,73 @@ class BuyProducts1(Page):
 
     @staticmethod
     def is_displayed(player: Player):
-        if player.position != "buyer":
-            return False
-
-        # Load buyer order
-        buyer_order = json.loads(player.group.buyer_order)
-
-        # Only show to the first ranked buyer
-        return player.id_in_group == buyer_order[0]
+        return is_buyer_turn(player, 1)  # Only the first ranked buyer
 
     @staticmethod
     def get_form_fields(player: Player):
-        fields = []
-
-        # Dynamically create Yes/No fields for each seller
-        for seller in player.group.get_players():
-            if seller.position == "seller" and seller.products > 0:
-                fields.append(f'b1_buy_decision_a{seller.id_in_group - 1}')  # Yes/No decision
-
-        # After Yes/No decision, allow specifying amount
-        for seller in player.group.get_players():
-            if seller.position == "seller" and seller.products > 0:
-                fields.append(f'b1_buy_amount_a{seller.id_in_group - 1}')  # Quantity field
-
-        return fields
+        return market_form_fields(player, 1)
 
     @staticmethod
     def vars_for_template(player: Player):
-        sellers = []
-        for seller in player.group.get_players():
-            if seller.position == "seller" and seller.products > 0:
-                sellers.append({
-                    'id': seller.id_in_group,
-                    'price': seller.product_price,
-                    'stock': seller.products,  # Each base produces 2 products
-                    'adjusted_id': seller.id_in_group - 1  # Seller ID - 1
-                })
+        return market_vars_for_template(player)
 
-        buyer_order = json.loads(player.group.buyer_order)
-        rank_index = buyer_order.index(player.id_in_group) + 1  # Convert 0-based index to 1-based rank
-        return {
-            'sellers': sellers,
-            'ledger': json.loads(player.group.public_ledger),
-            'buyer_order': buyer_order,
-            'rank_index': 1,
-            'random_number': player.subsession.random_number,
-            'instructions': f"You are ranked {rank_index}. You will buy when it's your turn.",
-        }
+    @staticmethod
+    def get_timeout_seconds(player: Player):
+        return phase_timeout(player, 'buying')
 
+    @staticmethod
     def before_next_page(player: Player, timeout_happened):
-        total_cost = 0  # Track total cost for the buyer
-
-        for seller in player.group.get_players():
-
-            if seller.position == "seller" and seller.products > 0:
-                decision_field = f'b1_buy_decision_a{seller.id_in_group - 1}'
-                quantity_field = f'b1_buy_amount_a{seller.id_in_group - 1}'
-
-                # ✅ Use field_maybe_none() to avoid NoneType error
-                buy_decision = player.field_maybe_none(decision_field) or False
-                quantity_requested = player.field_maybe_none(quantity_field) or 0
-
-                if buy_decision:  # Buyer said "Yes"
-                    available_stock = seller.products
-                    quantity_purchased = min(quantity_requested, available_stock)
-
-                    # **🚨 Prevent overspending**
-                    cost = quantity_purchased * seller.product_price
-                    if cost > player.tokens:
-                        raise ValueError(
-                            f"Error: You only have {player.tokens} tokens but tried to spend {cost}!"
-                        )  # ❌ Buyer tried to overspend
-
-                    if quantity_purchased > 0:
-                        # ✅ Update buyer's tokens
-                        player.tokens -= cost
-                        seller.tokens += cost
+        buy_from_market(player, 1, timeout_happened)
 
-                        # ✅ Update stock
-                        seller.products -= quantity_purchased  # Reduce products stock
-
-                        # ✅ Log transaction in the ledger
-                        player.group.add_to_ledger({
-                            'round': player.round_number,
-                            'type': "Product Sale",
-                            'buyer_id': player.id_in_group,
-                            'buyer_role': "Buyer",
-                            'seller_id': seller.id_in_group,
-                            'seller_role': "Seller",
-                            'amount': cost,
-                            'quantity': quantity_purchased,
-                            'remaining_stock': seller.products
-                        })
 
 class BuyProducts2(Page):
     form_model = 'player'
 
     @staticmethod
     def is_displayed(player: Player):
-        if player.position != "buyer":
-            return False
-
-        # Load buyer order
-        buyer_order = json.loads(player.group.buyer_order)
-
-        # Only show to the first ranked buyer
-        return player.id_in_group == buyer_order[1]
+        return is_buyer_turn(player, 2)  # Only the second ranked buyer
 
     @staticmethod
     def get_form_fields(player: Player):
-        fields = []
-
-        # Dynamically create Yes/No fields for each seller
-        for seller in player.group.get_players():
-            if seller.position == "seller" and seller.products > 0:
-                fields.append(f'b2_buy_decision_a{seller.id_in_group - 1}')  # Yes/No decision
-
-        # After Yes/No decision, allow specifying amount
-        for seller in player.group.get_players():
-            if seller.position == "seller" and seller.products > 0:
-                fields.append(f'b2_buy_amount_a{seller.id_in_group - 1}')  # Quantity field
-
-        return fields
+        return market_form_fields(player, 2)
 
     @staticmethod
     def vars_for_template(player: Player):
-        sellers = []
-        for seller in player.group.get_players():
-            if seller.position == "seller" and seller.products > 0:
-                sellers.append({
-                    'id': seller.id_in_group,
-                    'price': seller.product_price,
-                    'stock': seller.products,  # Each base produces 2 products
-                    'adjusted_id': seller.id_in_group - 1  # Seller ID - 1
-                })
+        return market_vars_for_template(player)
 
-        buyer_order = json.loads(player.group.buyer_order)
-        rank_index = buyer_order.index(player.id_in_group) + 1  # Convert 0-based index to 1-based rank
-        return {
-            'sellers': sellers,
-            'ledger': json.loads(player.group.public_ledger),
-            'buyer_order': buyer_order,
-            'rank_index': 1,
-            'random_number': player.subsession.random_number,
-            'instructions': f"You are ranked {rank_index}. You will buy when it's your turn.",
-        }
+    @staticmethod
+    def get_timeout_seconds(player: Player):
+        return phase_timeout(player, 'buying')
 
+    @staticmethod
     def before_next_page(player: Player, timeout_happened):
-        total_cost = 0  # Track total cost for the buyer
-
-        for seller in player.group.get_players():
-
-            if seller.position == "seller" and seller.products > 0:
-                decision_field = f'b2_buy_decision_a{seller.id_in_group - 1}'
-                quantity_field = f'b2_buy_amount_a{seller.id_in_group - 1}'
+        buy_from_market(player, 2, timeout_happened)
 
-                # ✅ Use field_maybe_none() to avoid NoneType error
-                buy_decision = player.field_maybe_none(decision_field) or False
-                quantity_requested = player.field_maybe_none(quantity_field) or 0
-
-                if buy_decision:  # Buyer said "Yes"
-                    available_stock = seller.products
-                    quantity_purchased = min(quantity_requested, available_stock)
-
-                    # **🚨 Prevent overspending**
-                    cost = quantity_purchased * seller.product_price
-                    if cost > player.tokens:
-                        raise ValueError(
-                            f"Error: You only have {player.tokens} tokens but tried to spend {cost}!"
-                        )  # ❌ Buyer tried to overspend
-
-                    if quantity_purchased > 0:
-                        # ✅ Update buyer's tokens
-                        player.tokens -= cost
-                        seller.tokens += cost
-
-                        # ✅ Update stock
-                        seller.products -= quantity_purchased  # Reduce products stock
-
-                        # ✅ Log transaction in the ledger
-                        player.group.add_to_ledger({
-                            'round': player.round_number,
-                            'type': "Product Sale",
-                            'buyer_id': player.id_in_group,
-                            'buyer_role': "Buyer",
-                            'seller_id': seller.id_in_group,
-                            'seller_role': "Seller",
-                            'amount': cost,
-                            'quantity': quantity_purchased,
-                            'remaining_stock': seller.products
-                        })
 
 class BuyProducts3(Page):
     form_model = 'player'
 
     @staticmethod
     def is_displayed(player: Player):
-        if player.position != "buyer":
-            return False
-
-        # Load buyer order
-        buyer_order = json.loads(player.group.buyer_order)
-
-        # Only show to the first ranked buyer
-        return player.id_in_group == buyer_order[2]
+        return is_buyer_turn(player, 3)  # Only the third ranked buyer
 
     @staticmethod
     def get_form_fields(player: Player):
-        fields = []
-
-        # Dynamically create Yes/No fields for each seller
-        for seller in player.group.get_players():
-            if seller.position == "seller" and seller.products > 0:
-                fields.append(f'b3_buy_decision_a{seller.id_in_group - 1}')  # Yes/No decision
-
-        # After Yes/No decision, allow specifying amount
-        for seller in player.group.get_players():
-            if seller.position == "seller" and seller.products > 0:
-                fields.append(f'b3_buy_amount_a{seller.id_in_group - 1}')  # Quantity field
-
-        return fields
+        return market_form_fields(player, 3)
 
     @staticmethod
     def vars_for_template(player: Player):
-        sellers = []
-        for seller in player.group.get_players():
-            if seller.position == "seller" and seller.products > 0:
-                sellers.append({
-                    'id': seller.id_in_group,
-                    'price': seller.product_price,
-                    'stock': seller.products,  # Each base produces 2 products
-                    'adjusted_id': seller.id_in_group - 1  # Seller ID - 1
-                })
+        return market_vars_for_template(player)
 
-        buyer_order = json.loads(player.group.buyer_order)
-        rank_index = buyer_order.index(player.id_in_group) + 1  # Convert 0-based index to 1-based rank
-        return {
-            'sellers': sellers,
-            'ledger': json.loads(player.group.public_ledger),
-            'buyer_order': buyer_order,
-            'rank_index': 1,
-            'random_number': player.subsession.random_number,
-            'instructions': f"You are ranked {rank_index}. You will buy when it's your turn.",
-        }
+    @staticmethod
+    def get_timeout_seconds(player: Player):
+        return phase_timeout(player, 'buying')
 
+    @staticmethod
     def before_next_page(player: Player, timeout_happened):
-        total_cost = 0  # Track total cost for the buyer
-
-        for seller in player.group.get_players():
-
-            if seller.position == "seller" and seller.products > 0:
-                decision_field = f'b3_buy_decision_a{seller.id_in_group - 1}'
-                quantity_field = f'b3_buy_amount_a{seller.id_in_group - 1}'
+        buy_from_market(player, 3, timeout_happened)
 
-                # ✅ Use field_maybe_none() to avoid NoneType error
-                buy_decision = player.field_maybe_none(decision_field) or False
-                quantity_requested = player.field_maybe_none(quantity_field) or 0
 
-                if buy_decision:  # Buyer said "Yes"
-                    available_stock = seller.products
-                    quantity_purchased = min(quantity_requested, available_stock)
-
-                    # **🚨 Prevent overspending**
-                    cost = quantity_purchased * seller.product_price
-                    if cost > player.tokens:
-                        raise ValueError(
-                            f"Error: You only have {player.tokens} tokens but tried to spend {cost}!"
-                        )  # ❌ Buyer tried to overspend
-
-                    if quantity_purchased > 0:
-                        # ✅ Update buyer's tokens
-                        player.tokens -= cost
-                        seller.tokens += cost
-
-                        # ✅ Update stock
-                        seller.products -= quantity_purchased  # Reduce products stock
-
-                        # ✅ Log transaction in the ledger
-                        player.group.add_to_ledger({
-                            'round': player.round_number,
-                            'type': "Product Sale",
-                            'buyer_id': player.id_in_group,
-                            'buyer_role': "Buyer",
-                            'seller_id': seller.id_in_group,
-                            'seller_role': "Seller",
-                            'amount': cost,
-                            'quantity': quantity_purchased,
-                            'remaining_stock': seller.products
-                        })
 class WaitForNextBuyer(WaitPage):
     """Ensures each buyer waits for the previous one to finish before purchasing"""
     wait_for_all_groups = True
@@ -675,9 +1014,18 @@ class ShowBuyerRank(Page):
             'buyer_order': buyer_order,
             'rank_index': rank_index,
             'random_number': player.subsession.random_number,
-            'guessed_number': player.guess
+            'guessed_number': player.field_maybe_none('guess')
         }
 
+    @staticmethod
+    def get_timeout_seconds(player: Player):
+        return phase_timeout(player, 'rank')
+
+    @staticmethod
+    def before_next_page(player: Player, timeout_happened):
+        if timeout_happened:
+            record_timeout(player, 'rank')
+
 
 class Results(Page):
     @staticmethod
@@ -692,7 +1040,13 @@ class Results(Page):
         }
 
 class Wait(WaitPage):
-    pass
+    after_all_players_arrive = 'end_wait'
+
+    @staticmethod
+    def vars_for_template(player: Player):
+        # Only rendered for players who actually wait, so the first render is the first arrival
+        note_wait_arrival(player.group)
+        return {}
 
 
 class WaitForProducerDecision(WaitPage):
@@ -707,7 +1061,16 @@ class GameResultsWaitPage(WaitPage):
     This WaitPage ensures that all participants finish their actions
     before viewing the final results.
     """
-    after_all_players_arrive = 'calculate_payoff'
+
+    @staticmethod
+    def vars_for_template(player: Player):
+        note_wait_arrival(player.group)
+        return {}
+
+    @staticmethod
+    def after_all_players_arrive(group: Group):
+        end_wait(group)
+        calculate_payoff(group)
 
 page_sequence = [
     Introduction,
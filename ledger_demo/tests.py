@@ -0,0 +1,127 @@
+from otree.api import Bot, Submission, expect
+from . import *
+
+
+class PlayerBot(Bot):
+    """
+    recovery: both sellers buy a base for 2 tokens and price their products
+    at 2. All buyers guess the same number, so they buy in id order (4, 5, 6).
+    In round 1, buyer 4 buys one product from seller 2. The market is then
+    corrupted before buyer 5 submits, and recovery has to repair it.
+
+    timeouts: pages time out with form data that the timeout decision must
+    override. Round 1: seller 2 gets no offer and buyer 4 no purchase.
+    Round 2: seller 3 keeps its round 1 price. Round 3: the producer rejects.
+    """
+
+    cases = ['recovery', 'timeouts']
+
+    def play_round(self):
+        if self.case == 'timeouts':
+            yield from self.play_timeouts()
+        else:
+            yield from self.play_recovery()
+
+    def play_recovery(self):
+        yield Introduction
+
+        if self.player.position == "seller":
+            yield OfferToProducer, dict(offer_to_producer=2)
+        if self.player.position == "producer":
+            yield DecideOnOffer, dict(accept_offer_2=True, accept_offer_3=True)
+        if self.player.position == "seller":
+            yield SetProductPrice, dict(product_price=2)
+
+        if self.player.position == "buyer":
+            yield GuessNumber, dict(guess=50)
+            yield ShowBuyerRank
+
+            if self.player.id_in_group == 4:
+                purchase = dict(b1_buy_decision_a1=True, b1_buy_amount_a1=1) if self.round_number == 1 else {}
+                yield Submission(BuyProducts1, purchase, check_html=False)
+            elif self.player.id_in_group == 5:
+                if self.round_number == 1:
+                    self.corrupt_market()
+                yield Submission(BuyProducts2, {}, check_html=False)
+            else:
+                yield Submission(BuyProducts3, {}, check_html=False)
+
+        if self.round_number == 1:
+            tokens = [p.tokens for p in self.group.get_players()]
+            expect(tokens, [4, 3, 1, 3, 5, 5])
+            expect(self.group.get_player_by_id(2).products, 1)
+            expect(self.group.get_player_by_id(3).products, 2)
+            expect(json.loads(self.group.monitor)['recovered'], 3)
+            expect(len(json.loads(self.group.public_ledger)), 3)
+
+        # Results is the last page and has no next button
+        yield Submission(Results, check_html=False)
+
+    def play_timeouts(self):
+        yield Introduction
+
+        if self.player.id_in_group == 2:
+            yield Submission(OfferToProducer, dict(offer_to_producer=2), timeout_happened=self.round_number == 1)
+        elif self.player.position == "seller":
+            yield OfferToProducer, dict(offer_to_producer=2)
+
+        if self.player.position == "producer":
+            # Only seller 3's offer is accepted, so seller 2 never has products to price
+            decisions = dict(accept_offer_3=True) if self.round_number == 1 else dict(accept_offer_2=False, accept_offer_3=True)
+            yield Submission(DecideOnOffer, decisions, timeout_happened=self.round_number == 3)
+
+        if self.player.id_in_group == 3 and self.round_number != 3:
+            price = 3 if self.round_number == 1 else 5
+            yield Submission(SetProductPrice, dict(product_price=price), timeout_happened=self.round_number == 2)
+
+        if self.player.position == "buyer":
+            yield GuessNumber, dict(guess=50)
+            yield ShowBuyerRank
+
+            if self.player.id_in_group == 4:
+                purchase = dict(b1_buy_decision_a2=True, b1_buy_amount_a2=1)
+                yield Submission(BuyProducts1, purchase, check_html=False, timeout_happened=self.round_number == 1)
+            elif self.player.id_in_group == 5:
+                purchase = dict(b2_buy_decision_a2=True, b2_buy_amount_a2=1) if self.round_number == 1 else {}
+                yield Submission(BuyProducts2, purchase, check_html=False)
+            else:
+                yield Submission(BuyProducts3, {}, check_html=False)
+
+        tokens = [p.tokens for p in self.group.get_players()]
+        seller_2 = self.group.get_player_by_id(2)
+        seller_3 = self.group.get_player_by_id(3)
+        stall_stats = json.loads(self.group.stall_stats)
+        if self.round_number == 1:
+            expect(seller_2.field_maybe_none('offer_to_producer'), None)
+            expect(tokens, [2, 3, 4, 5, 2, 5])
+            expect(seller_3.products, 1)
+            expect(len(json.loads(self.group.public_ledger)), 2)
+            expect(stall_stats, {
+                'offer': {'timeouts': 1, 'players': [2]},
+                'buying': {'timeouts': 1, 'players': [4]},
+            })
+        elif self.round_number == 2:
+            expect(seller_3.product_price, 3)
+            expect(stall_stats, {'pricing': {'timeouts': 1, 'players': [3]}})
+        elif self.round_number == 3:
+            expect(tokens, [0, 3, 3, 5, 5, 5])
+            expect(self.group.get_player_by_id(1).bases, 2)
+            expect(seller_3.bases, 0)
+            expect(json.loads(self.group.public_ledger), [])
+            expect(stall_stats, {'decision': {'timeouts': 1, 'players': [1]}})
+
+        yield Submission(Results, check_html=False)
+
+    def corrupt_market(self):
+        # Simulate a restart: the market is reloaded from its snapshot
+        LIVE_MARKETS.clear()
+        RECOVERED_GROUPS.clear()
+        market = market_state(self.group)
+
+        # Buyer 4's logged sale is undone in the holdings (must be replayed)
+        market.tokens[3] += 2
+        market.tokens[1] -= 2
+        market.products[1] += 1
+
+        # Seller 3 gains tokens with no ledger entry (must be rolled back)
+        market.tokens[2] += 4
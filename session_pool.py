@@ -0,0 +1,128 @@
+"""
+Pre-create a pool of ledger_demo sessions so a lab session can start instantly.
+
+Sessions are created ahead of time through the oTree REST API, which runs
+creating_session (roles, random numbers, starting tokens and bases) before
+anyone is waiting. Claiming a session just hands out its links.
+
+    python session_pool.py fill 3 --participants 120
+    python session_pool.py claim
+    python session_pool.py status
+
+Claimed sessions keep the 'pool' label. oTree's REST API has no
+compare-and-set, so claims are kept on this machine instead: one file per
+session in OTREE_POOL_CLAIMS_DIR (default session_pool_claims/ next to this
+script), created atomically so a session is never handed out twice. Run
+'claim' on the machine that holds that directory.
+
+Set OTREE_SERVER_URL (default http://localhost:8000) and OTREE_REST_KEY
+to the same REST key the server uses.
+"""
+
+import argparse
+import json
+import os
+import urllib.request
+
+SERVER_URL = os.environ.get('OTREE_SERVER_URL', 'http://localhost:8000').rstrip('/')
+REST_KEY = os.environ.get('OTREE_REST_KEY', '')
+CLAIMS_DIR = os.environ.get(
+    'OTREE_POOL_CLAIMS_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'session_pool_claims')
+)
+
+SESSION_CONFIG_NAME = 'ledger_demo'
+POOL_LABEL = 'pool'
+
+
+def call_api(method, path, payload=None):
+    data = json.dumps(payload).encode() if payload is not None else None
+    request = urllib.request.Request(
+        SERVER_URL + path,
+        data=data,
+        method=method,
+        headers={'otree-rest-key': REST_KEY, 'Content-Type': 'application/json'},
+    )
+    with urllib.request.urlopen(request) as response:
+        return json.loads(response.read() or 'null')
+
+
+def claimed_codes():
+    if not os.path.isdir(CLAIMS_DIR):
+        return set()
+    return set(os.listdir(CLAIMS_DIR))
+
+
+def pool_sessions():
+    claimed = claimed_codes()
+    sessions = [
+        s for s in call_api('GET', '/api/sessions')
+        if s['label'] == POOL_LABEL and s['config_name'] == SESSION_CONFIG_NAME
+    ]
+    for session in sessions:
+        session['claimed'] = session['code'] in claimed
+    return sessions
+
+
+def fill(count, participants):
+    for _ in range(count):
+        # Seed each session so its random numbers are fixed at staging time
+        session = call_api('POST', '/api/sessions', dict(
+            session_config_name=SESSION_CONFIG_NAME,
+            num_participants=participants,
+            label=POOL_LABEL,
+            modified_session_config_fields=dict(random_seed=int.from_bytes(os.urandom(4), 'big')),
+        ))
+        print(f"Staged {session['code']} ({participants} participants)")
+
+
+def claim():
+    os.makedirs(CLAIMS_DIR, exist_ok=True)
+    for session in pool_sessions():
+        if session['claimed']:
+            continue
+
+        # O_EXCL fails if another claim created the file first
+        try:
+            fd = os.open(os.path.join(CLAIMS_DIR, session['code']), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            continue
+        os.close(fd)
+
+        print(f"Claimed {session['code']}")
+        print(f"Session-wide link: {session['session_wide_url']}")
+        print(f"Admin: {session['admin_url']}")
+        return
+
+    raise SystemExit("The pool is empty. Run 'fill' first.")
+
+
+def status():
+    sessions = pool_sessions()
+    for session in sessions:
+        state = "claimed" if session['claimed'] else "ready"
+        print(f"{session['code']}  {session['num_participants']:>4} participants  {state}")
+    print(f"{sum(not s['claimed'] for s in sessions)} of {len(sessions)} sessions ready")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage a pool of pre-created ledger_demo sessions.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    fill_parser = commands.add_parser('fill', help="Pre-create sessions and add them to the pool")
+    fill_parser.add_argument('count', type=int)
+    fill_parser.add_argument('--participants', type=int, default=6)
+
+    commands.add_parser('claim', help="Take a ready session from the pool and print its links")
+    commands.add_parser('status', help="List pooled sessions")
+
+    args = parser.parse_args()
+    if args.command == 'fill':
+        fill(args.count, args.participants)
+    elif args.command == 'claim':
+        claim()
+    else:
+        status()
+
+
+if __name__ == '__main__':
+    main()
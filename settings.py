@@ -6,6 +6,22 @@ SESSION_CONFIGS = [
         app_sequence=['ledger_demo'],
         num_demo_participants=6,
         treatment='correct',  # Change to 'correct' for suggestions to be displayed
+        random_seed=0,  # 0 = unseeded; session_pool.py sets one per pooled session
+        # Seconds before a page auto-submits (0 = no timeout)
+        offer_timeout_seconds=0,
+        decision_timeout_seconds=0,
+        pricing_timeout_seconds=0,
+        guess_timeout_seconds=0,
+        buying_timeout_seconds=0,
+        introduction_timeout_seconds=0,
+        rank_timeout_seconds=0,  # ShowBuyerRank
+        # Decision applied on timeout: no_offer, reject, keep_last_price,
+        # midpoint_guess, no_guess, no_purchase
+        offer_timeout_decision='no_offer',
+        decision_timeout_decision='reject',
+        pricing_timeout_decision='keep_last_price',
+        guess_timeout_decision='midpoint_guess',
+        buying_timeout_decision='no_purchase',
     )
 ]
 